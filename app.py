@@ -9,39 +9,55 @@ from streamlit_autorefresh import st_autorefresh
 from google.cloud.firestore_v1.base_query import FieldFilter
 import numpy as np
 import random
+import math
 import time
+import os
+import multiprocessing
+import glob
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from usage_stats import compute_usage_stats
+from result_cache import ResultCache
+from history_store import HistoryStore, DEFAULT_CHUNK_ROWS
+from event_buffer import EventTimeBuffer
+
+# Streamlit이 실행한 스크립트인지 여부
+# 프로세스 풀(spawn) 워커는 이 스크립트를 __mp_main__으로 다시 읽으므로, 화면 구성과 Firebase 연결 같은 실행 코드는
+# 이 값이 참일 때만 실행하고 워커에서는 함수 정의만 읽히도록 함
+IS_APP_SCRIPT = __name__ == "__main__"
+
+if IS_APP_SCRIPT:
+    st.set_page_config(initial_sidebar_state="collapsed")  # 사이드바를 기본 닫힘 상태로 설정
+
+    # Google Fonts에서 나눔 고딕 불러오기 및 적용
+    st.markdown("""
+        <style>
+        @import url('https://fonts.googleapis.com/css2?family=Nanum+Gothic&display=swap');
 
-st.set_page_config(initial_sidebar_state="collapsed")  # 사이드바를 기본 닫힘 상태로 설정
-
-# Google Fonts에서 나눔 고딕 불러오기 및 적용
-st.markdown("""
-    <style>
-    @import url('https://fonts.googleapis.com/css2?family=Nanum+Gothic&display=swap');
-
-    * {
-        font-family: 'Nanum Gothic', sans-serif;
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
-# PWA 관련 설정
-st.markdown(
-    """
-    <link rel="manifest" href="manifest.json">
-    <script>
-    if ('serviceWorker' in navigator) {
-        navigator.serviceWorker.register('service-worker.js').then(function() {
-            console.log('Service Worker Registered');
-        });
-    }
-    </script>
-    """,
-    unsafe_allow_html=True
-)
+        * {
+            font-family: 'Nanum Gothic', sans-serif;
+        }
+        </style>
+        """, unsafe_allow_html=True)
+
+    # PWA 관련 설정
+    st.markdown(
+        """
+        <link rel="manifest" href="manifest.json">
+        <script>
+        if ('serviceWorker' in navigator) {
+            navigator.serviceWorker.register('service-worker.js').then(function() {
+                console.log('Service Worker Registered');
+            });
+        }
+        </script>
+        """,
+        unsafe_allow_html=True
+    )
 
-# 페이지 상태를 세션 상태에 저장
-if 'page' not in st.session_state:
-    st.session_state.page = 'home'
+    # 페이지 상태를 세션 상태에 저장
+    if 'page' not in st.session_state:
+        st.session_state.page = 'home'
 
 # 페이지 전환을 위한 함수 정의
 def set_page(page_name):
@@ -66,51 +82,162 @@ def initialize_firebase():
         firebase_admin.initialize_app(cred)
     return firestore.client()
 
-db = initialize_firebase()
+if IS_APP_SCRIPT:
+    db = initialize_firebase()
 
-# Initialize session state for page navigation
-if 'page' not in st.session_state:
-    st.session_state.page = 'home'
+    # Initialize session state for page navigation
+    if 'page' not in st.session_state:
+        st.session_state.page = 'home'
 
 # Sample EP data for demonstration
 EP_LIST = [f"EP_{i}" for i in range(1, 17)]
 
-# 초기 데이터 생성 (EP별 데이터 샘플)
-@st.cache_data
+# 실시간 데이터 보존 기간과 기본 허용 지연 시간 (기기 시각 기준)
+RETENTION = timedelta(minutes=10)
+ALLOWED_LATENESS = timedelta(minutes=1)
+MAX_CLOCK_SKEW = timedelta(minutes=5)  # 수신 시각보다 이만큼 넘게 미래인 기기 시각은 버림
+
+# 실시간 데이터 출처 ('firestore': 기기 측정값, 'simulation': 임의 데이터)
+DATA_SOURCE = os.environ.get('WATERFLOW_DATA_SOURCE', 'simulation')
+
+# 초기 데이터 생성 (EP별 데이터 샘플, 세션마다 새로 생성)
 def initialize_data():
-    data = {
-        ep: pd.DataFrame({
-            'timestamp': pd.date_range(start=datetime.now() - timedelta(hours=1), periods=30, freq='2S'),
-            'flowRate': np.random.randint(10, 100, size=30)
-        }) for ep in EP_LIST
-    }
-    return data
+    st.session_state.ep_buffers = {ep: EventTimeBuffer(RETENTION, ALLOWED_LATENESS) for ep in EP_LIST}
+    for ep, buffer in st.session_state.ep_buffers.items():
+        timestamps = pd.date_range(start=datetime.now() - timedelta(hours=1), periods=30, freq='2S')
+        for timestamp, flow_rate in zip(timestamps, np.random.randint(10, 100, size=30)):
+            buffer.add(timestamp, flow_rate)
+    return {ep: buffer.to_frame() for ep, buffer in st.session_state.ep_buffers.items()}
+
+# 기기 시각이 찍힌 측정값 (ep, timestamp, flowRate) 목록을 EP별 버퍼에 반영
+# 값이 반영된 EP의 데이터만 다시 만듦
+def ingest_readings(readings):
+    changed_eps = set()
+    for ep, timestamp, flow_rate in readings:
+        buffer = st.session_state.ep_buffers.get(ep)
+        if buffer is None:
+            continue
+        if timestamp is None or flow_rate is None:
+            buffer.reject()  # 해석할 수 없는 측정값
+        elif buffer.add(timestamp, flow_rate):
+            changed_eps.add(ep)
+
+    for ep in changed_eps:
+        st.session_state.historical_data[ep] = st.session_state.ep_buffers[ep].to_frame()
+
+# 기기 시각을 서버 현지 시각(타임존 없음)으로 변환 (기기 시각이 없으면 서버 수신 시각 사용)
+# 해석할 수 없거나 수신 시각 + MAX_CLOCK_SKEW보다 미래인 값은 None
+def parse_device_time(value, received_at):
+    if value is None:
+        return pd.Timestamp(received_at)
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            # epoch 값 - 1e11 이상이면 밀리초로 판단 (초 단위로는 5138년 이후)
+            unit = 'ms' if abs(value) >= 1e11 else 's'
+            timestamp = pd.Timestamp(value, unit=unit, tz='UTC')
+        else:
+            timestamp = pd.Timestamp(value)  # Firestore Timestamp(datetime) 또는 ISO 문자열
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if pd.isna(timestamp):
+        return None
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert(datetime.now().astimezone().tzinfo).tz_localize(None)
+    if timestamp > pd.Timestamp(received_at) + MAX_CLOCK_SKEW:
+        return None
+    return timestamp
+
+# 유량 값을 숫자로 변환 (해석할 수 없거나 NaN/무한대이면 None)
+def parse_flow_rate(value):
+    try:
+        flow_rate = float(value)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    return flow_rate if math.isfinite(flow_rate) else None
+
+# 가져오기 후 EP·월 파티션 압축과 일별 롤업 계산에 쓰는 프로세스 풀 (서버의 모든 코어 사용, 세션 간 공유)
+@st.cache_resource
+def get_compaction_executor():
+    # Streamlit 서버는 멀티스레드이므로 fork 대신 spawn으로 워커 생성
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn'))
+
+# EP 데이터의 버전 (EP 버퍼가 바뀔 때마다 새로 발급되는 번호) - 늦게 도착한 값이 삽입되어도 바뀜
+def get_data_version(ep_frames):
+    versions = []
+    for ep, data in ep_frames.items():
+        if 'version' not in data.attrs:
+            raise ValueError(f'{ep} data has no version; build it with EventTimeBuffer')
+        versions.append((ep, data.attrs['version']))
+    return tuple(versions)
+
+# 세션 간 공유 결과 캐시 - 가져온 기록의 통계처럼 여러 세션이 같은 키로 조회하는 결과만 저장 (대략적인 크기 기준 LRU)
+SHARED_CACHE_BYTES = 256 * 1024 * 1024
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(max_bytes=SHARED_CACHE_BYTES)
+
+# 세션별 결과 캐시 - 실시간 데이터의 그래프·합산처럼 갱신마다 버전이 바뀌는 결과를 저장
+# 공유 캐시에 넣으면 다시 읽히지 않는 항목이 공유 결과를 밀어내므로 세션마다 작은 캐시를 따로 둠
+def get_session_cache():
+    if 'result_cache' not in st.session_state:
+        st.session_state.result_cache = ResultCache(max_entries=32)
+    return st.session_state.result_cache
+
+# 가져온 EP 기록 저장소 (세션 간 공유)
+HISTORY_DIR = 'history'
+EXPORT_DIR = 'exports'
+IMPORT_DIR = 'imports'  # 서버 파일 가져오기는 이 폴더 안의 파일만 허용
+EXPORT_TTL = timedelta(hours=1)  # 내보낸 파일 보관 시간
+EXPORT_DOWNLOAD_LIMIT = 100 * 1024 * 1024  # 다운로드 버튼은 파일 전체를 메모리에 올리므로 이 크기 이하만 제공
+
+@st.cache_resource
+def get_history_store():
+    return HistoryStore(HISTORY_DIR)
+
+# 통계 조회 (실시간 데이터와 가져온 기록 모두 일별 롤업에서 합산, 원본 스캔은 가져오기 시 프로세스 풀에서 한 번만 수행)
+# - 가져온 기록: (조회 조건, 저장소 버전) 기준으로 캐시 - 저장소는 세션 간 공유되므로 다른 세션의 같은 조회도 적중
+# - 실시간 데이터: (조회 조건, EP 버퍼 버전) 기준으로 캐시 - 버퍼가 세션별이므로 같은 세션 안에서만 적중
+def query_usage_stats(start, end, freq, ep_frames):
+    store = get_history_store()
+    eps = tuple(ep_frames)
+    stored_key = ('stored_usage', eps, start, end, freq, store.version)
+    live_key = ('live_usage', start, end, freq, get_data_version(ep_frames))
+    with st.spinner("통계 계산 중..."):
+        stored_usage = get_result_cache().get_or_compute(stored_key, lambda: store.rollup_usage(list(eps), start, end, freq))
+        live_usage = get_session_cache().get_or_compute(live_key, lambda: compute_usage_stats(ep_frames, start, end, freq))
+    return live_usage + stored_usage
 
 # Firestore에서 데이터 가져오기
 def get_firestore_data():
     doc_ref = db.collection('Waterflow_data').document('realtime')
     doc = doc_ref.get()
-    if doc.exists():
+    if doc.exists:
         return doc.to_dict()
     return None
 
-# 데이터 업데이트 함수
-def update_data(historical_data):
+# Firestore의 기기 측정값을 (ep, timestamp, flowRate) 목록으로 읽는 함수
+def read_firestore_readings(eps):
     firestore_data = get_firestore_data()
-    if firestore_data:
-        current_time = datetime.now()
-        for ep, df in historical_data.items():
-            if ep in firestore_data:
-                flow_rate = firestore_data[ep].get('flowRate', 0)
-                new_data = pd.DataFrame({'timestamp': [current_time], 'flowRate': [flow_rate]})
-                historical_data[ep] = pd.concat([historical_data[ep], new_data]).reset_index(drop=True)
-                
-                # 최근 10분의 데이터만 유지
-                historical_data[ep] = historical_data[ep][historical_data[ep]['timestamp'] > current_time - timedelta(minutes=10)]
-    return historical_data
-
-@st.cache_data
+    if not firestore_data:
+        return []
+
+    received_at = datetime.now()
+    readings = []
+    for ep in eps:
+        if ep in firestore_data:
+            # 일괄 업로드(readings 목록)와 단일 측정값 모두 기기 시각 기준으로 반영
+            for reading in firestore_data[ep].get('readings', [firestore_data[ep]]):
+                timestamp = parse_device_time(reading.get('timestamp'), received_at)
+                readings.append((ep, timestamp, parse_flow_rate(reading.get('flowRate', 0))))
+    return readings
+
+# EP 그래프 생성 (EP와 데이터 버전 기준으로 캐시)
 def create_graph(data, ep):
+    key = ('graph', ep, get_data_version({ep: data}))
+    return get_session_cache().get_or_compute(key, lambda: build_graph(data, ep))
+
+def build_graph(data, ep):
     fig = go.Figure()
     
     if not data.empty:
@@ -122,14 +249,40 @@ def create_graph(data, ep):
         ))
     
     fig.update_layout(
-        title=f'Flow Rate for {ep} over Time',
+        title=f'{ep}의 Flow Rate',
         xaxis_title='Time',
         yaxis_title='Flow Rate',
+        xaxis=dict(type='date', tickformat='%H:%M:%S'),  # 2초 단위로 시간 형식 지정
         height=300  # 그래프 높이 조정
     )
     
     return fig
 
+# 그룹 합산 그래프 생성 (그룹 구성과 데이터 버전 기준으로 캐시)
+def create_group_graph(group_name, group_eps, ep_data):
+    group_frames = {ep: ep_data[ep] for ep in group_eps}
+    key = ('group_graph', group_name, tuple(group_eps), get_data_version(group_frames))
+    return get_session_cache().get_or_compute(key, lambda: build_group_graph(group_name, group_eps, ep_data))
+
+def build_group_graph(group_name, group_eps, ep_data):
+    combined_data = calculate_group_data(group_eps, ep_data)
+
+    fig = go.Figure()
+    if combined_data is not None:
+        fig.add_trace(go.Scatter(
+            x=combined_data['timestamp'], 
+            y=combined_data['flowRate'],
+            mode='lines+markers',
+            name=f"{group_name} GROUP TOTAL DATA"
+        ))
+
+    fig.update_layout(
+        title=f'{group_name} FLOW RATE DATA',
+        xaxis=dict(type='date', tickformat='%H:%M:%S'),  # 2초 단위로 시간 형식 지정
+        height=400
+    )
+    return fig
+
 def get_current_datetime():
     now = datetime.now()
     return now.strftime("%Y년 %m월 %d일 %H시 %M분")
@@ -176,7 +329,8 @@ def create_hourly_usage_graph(hourly_usage):
 
 # Example usage
 hourly_data = [104, 89, 92, 123, 55, 50, 52, 89, 72, 61, 106, 140, 60, 108, 66, 91, 143, 142, 128, 121, 72, 137, 132, 51]
-graph = create_hourly_usage_graph(hourly_data)
+if IS_APP_SCRIPT:
+    graph = create_hourly_usage_graph(hourly_data)
 
 def calculate_daily_usage(hourly_usage):
     return sum(hourly_usage)
@@ -185,10 +339,11 @@ def calculate_estimated_bill(daily_usage, rate):
     return daily_usage * rate
 
 # 기본 지역과 용도를 세션 상태에 초기화 (여기에 추가합니다)
-if 'region' not in st.session_state:
-    st.session_state.region = '서울'  # 기본값을 '서울'로 설정
-if 'usage_type' not in st.session_state:
-    st.session_state.usage_type = '가정용'  # 기본값을 '가정용'으로 설정
+if IS_APP_SCRIPT:
+    if 'region' not in st.session_state:
+        st.session_state.region = '서울'  # 기본값을 '서울'로 설정
+    if 'usage_type' not in st.session_state:
+        st.session_state.usage_type = '가정용'  # 기본값을 '가정용'으로 설정
 
 # 기존 홈 페이지 함수 수정 (autorefresh로 특정 요소만 갱신)
 def home_page():
@@ -272,49 +427,39 @@ def display_total_flow():
 
 # 이번 달 사용량 계산 함수
 def calculate_current_month_usage():
-    total_flow = 0
-    current_time = datetime.now()
-    current_month = current_time.month
-
-    for ep, data in st.session_state.historical_data.items():
-        # 이번 달 데이터만 계산
-        data['timestamp'] = pd.to_datetime(data['timestamp'])
-        current_month_data = data[data['timestamp'].dt.month == current_month]
-        if not current_month_data.empty:
-            total_flow += current_month_data['flowRate'].sum()
-
-    return total_flow
+    month_start = pd.Timestamp(datetime.now().date()).replace(day=1)
+    return calculate_month_usage(month_start)
 
 # 전월 사용량 계산 함수
 def calculate_previous_month_usage():
-    total_flow = 0
+    month_start = pd.Timestamp(datetime.now().date()).replace(day=1) - pd.offsets.MonthBegin(1)
+    return calculate_month_usage(month_start)
+
+# 해당 월의 전체 EP 사용량 합계 (통계 페이지와 같이 실시간 데이터의 일별 롤업과 가져온 기록의 롤업을 합산)
+# 실시간 롤업에는 이 세션이 열린 뒤 수집한 값만 있으므로 가져온 기록을 함께 더해야 월 전체 사용량이 됨
+def calculate_month_usage(month_start):
+    rollup_frames = {ep: buffer.rollup_frame() for ep, buffer in st.session_state.ep_buffers.items()}
+    month_end = month_start + pd.offsets.MonthBegin(1)
+    return float(query_usage_stats(month_start, month_end, 'MS', rollup_frames).to_numpy().sum())
+
+# 임의 측정값 생성 함수 (모든 EP에 새로운 2초 단위 데이터, 기기 시각은 현재 시각으로 가정)
+def simulate_readings(eps):
     current_time = datetime.now()
-    previous_month = (current_time.month - 1) if current_time.month > 1 else 12
-
-    for ep, data in st.session_state.historical_data.items():
-        # 전월 데이터만 계산
-        data['timestamp'] = pd.to_datetime(data['timestamp'])
-        previous_month_data = data[data['timestamp'].dt.month == previous_month]
-        if not previous_month_data.empty:
-            total_flow += previous_month_data['flowRate'].sum()
-
-    return total_flow
+    return [
+        (ep, current_time, random.randint(10, 100))  # random 모듈을 사용해 임의의 데이터 생성
+        for ep in eps
+    ]
 
 # 갱신 시간 설정 및 데이터 갱신 함수
 def update_data(historical_data):
-    # 모든 EP 데이터에 새로운 2초 단위 데이터를 추가
-    for ep in st.session_state.historical_data:
-        # 새로운 데이터 추가
-        new_row = pd.DataFrame({
-            'timestamp': [datetime.now()],
-            'flowRate': [random.randint(10, 100)]  # random 모듈을 사용해 임의의 데이터 생성
-        })
-        st.session_state.historical_data[ep] = pd.concat([st.session_state.historical_data[ep], new_row], ignore_index=True)
+    if DATA_SOURCE == 'firestore':
+        readings = read_firestore_readings(list(historical_data))
+    else:
+        readings = simulate_readings(list(historical_data))
 
-        # 10분 전 데이터까지만 유지 (필요 시 수정 가능)
-        st.session_state.historical_data[ep] = st.session_state.historical_data[ep][
-            st.session_state.historical_data[ep]['timestamp'] > datetime.now() - timedelta(minutes=10)
-        ]
+    # 정렬 삽입과 보존 기간(최근 10분) 관리는 EP별 버퍼에서 처리
+    ingest_readings(readings)
+    return historical_data
 
 def realtime_data_page():
     st.title("REALTIME WATERFLOW DATA")
@@ -326,6 +471,11 @@ def realtime_data_page():
     # 갱신 시간 설정 (2초 ~ 10초)
     refresh_interval = st.sidebar.slider("데이터 갱신 시간 (초)", 2, 10, 2)
     
+    # 허용 지연 시간 설정 (워터마크보다 늦게 도착한 측정값은 버림)
+    allowed_lateness = st.sidebar.slider("허용 지연 시간 (초)", 0, int(RETENTION.total_seconds()), int(ALLOWED_LATENESS.total_seconds()))
+    for buffer in st.session_state.ep_buffers.values():
+        buffer.allowed_lateness = timedelta(seconds=allowed_lateness)
+    
     # 자동 갱신 설정
     st_autorefresh(interval=refresh_interval * 1000, key="data_refresh")
 
@@ -356,93 +506,137 @@ def realtime_data_page():
     
     # 본 페이지에 그래프 표시
     if display_option == "그룹" and selected_eps:
-        # 그룹 데이터 합산 및 시각화
-        combined_data = calculate_group_data(selected_eps, st.session_state.historical_data)
-
-        # 그룹 합산 그래프 표시
-        fig = go.Figure()
-        if combined_data is not None:
-            fig.add_trace(go.Scatter(
-                x=combined_data['timestamp'], 
-                y=combined_data['flowRate'],
-                mode='lines+markers',
-                name=f"{selected_group} GROUP TOTAL DATA"
-            ))
-
-        fig.update_layout(
-            title=f'{selected_group} FLOW RATE DATA',
-            xaxis=dict(type='date', tickformat='%H:%M:%S'),  # 2초 단위로 시간 형식 지정
-            height=400
-        )
+        # 그룹 데이터 합산 및 그룹 합산 그래프 표시
+        fig = create_group_graph(selected_group, selected_eps, st.session_state.historical_data)
         st.plotly_chart(fig, use_container_width=True)
 
     elif display_option == "디바이스" and selected_eps:
         # 선택된 각 EP에 대한 그래프 개별 표시
         for ep in selected_eps:
-            ep_data = st.session_state.historical_data[ep]
-            
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(
-                x=ep_data['timestamp'], 
-                y=ep_data['flowRate'],
-                mode='lines+markers',
-                name=ep
-            ))
-
-            fig.update_layout(
-                title=f'{ep}의 Flow Rate',
-                xaxis_title='Time',
-                yaxis_title='Flow Rate',
-                xaxis=dict(type='date', tickformat='%H:%M:%S'),  # 2초 단위로 시간 형식 지정
-                height=300
-            )
+            fig = create_graph(st.session_state.historical_data[ep], ep)
             st.plotly_chart(fig, use_container_width=True)
 
     # 데이터 최신화 시간 표시
     st.write(f"LAST UPDATE: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
+    # 늦게 도착한 측정값 현황
+    late_count = sum(buffer.late_count for buffer in st.session_state.ep_buffers.values())
+    dropped_count = sum(buffer.dropped_count for buffer in st.session_state.ep_buffers.values())
+    st.caption(f"지연 도착 반영 {late_count}건 / 허용 지연 초과로 제외 {dropped_count}건")
+
 # Sidebar for statistics type selection
 def statistics_page():
     st.title("STATISTICS")
 
+    # 데이터 초기화
+    if 'historical_data' not in st.session_state:
+        st.session_state.historical_data = initialize_data()
+
     # Sidebar에서 일, 월, 연 사용량 선택
     stat_type = st.sidebar.radio("유형 선택", ["일 사용량", "월 사용량", "연 사용량"])
 
+    # 통계 대상 선택 (전체 EP 또는 그룹)
+    groups = st.session_state.get('groups', {})
+    target = st.sidebar.selectbox("통계 대상", ["전체"] + list(groups.keys()))
+    target_eps = EP_LIST if target == "전체" else groups[target]
+    # 실시간 데이터는 EP별 일별 롤업으로 통계 계산 (보존 기간이 지난 값과 늦게 도착한 값도 반영됨)
+    ep_frames = {ep: st.session_state.ep_buffers[ep].rollup_frame() for ep in target_eps if ep in st.session_state.ep_buffers}
+
     # Date selection for filtering data
     if stat_type == "일 사용량":
-        daily_usage_page()
+        daily_usage_page(ep_frames)
     elif stat_type == "월 사용량":
-        monthly_usage_page()
+        monthly_usage_page(ep_frames)
     elif stat_type == "연 사용량":
-        yearly_usage_page()
+        yearly_usage_page(ep_frames)
+
+    # 선택한 대상의 기록 내보내기
+    history_export_section(list(ep_frames))
+
+    # 캐시 적중률 표시 (이번 실행의 조회까지 반영되도록 페이지 내용 다음에 표시)
+    cache_stats = get_result_cache().stats()
+    st.sidebar.caption(
+        f"공유 캐시 적중률 {cache_stats['hit_rate']:.0%} "
+        f"(적중 {cache_stats['hits']} / 미스 {cache_stats['misses']} / 항목 {cache_stats['entries']}, "
+        f"{cache_stats['bytes'] / 1024 / 1024:.1f} MB)"
+    )
+
+# 기록 내보내기 (선택 구간을 EP·월 단위로 이어 써서 서버 파일로 저장 후 다운로드)
+def history_export_section(eps):
+    st.subheader("데이터 내보내기")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        start_date = st.date_input("시작일", value=datetime.now().date().replace(day=1), key="export_start")
+    with col2:
+        end_date = st.date_input("종료일", value=datetime.now().date(), key="export_end")
+    file_format = st.radio("파일 형식", ["csv", "parquet"], horizontal=True, key="export_format")
+
+    if st.button("내보내기"):
+        if start_date > end_date:
+            st.error("시작일은 종료일보다 늦을 수 없습니다.")
+            return
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        cleanup_exports()
+        export_path = os.path.join(EXPORT_DIR, f"history_{start_date:%Y%m%d}_{end_date:%Y%m%d}_{uuid.uuid4().hex[:8]}.{file_format}")
+        with st.spinner("내보내는 중..."):
+            rows = get_history_store().export_range(
+                eps, pd.Timestamp(start_date), pd.Timestamp(end_date) + pd.Timedelta(days=1), export_path, file_format
+            )
+        st.session_state.export_path = export_path
+        st.success(f"{rows:,}행을 내보냈습니다. (서버 경로: {export_path})")
+
+    export_path = st.session_state.get('export_path')
+    if export_path and os.path.exists(export_path):
+        if os.path.getsize(export_path) <= EXPORT_DOWNLOAD_LIMIT:
+            with open(export_path, 'rb') as f:
+                st.download_button("다운로드", f, file_name=os.path.basename(export_path))
+        else:
+            st.write(f"파일이 커서 다운로드 버튼을 제공하지 않습니다. 서버 경로에서 가져가주세요: {export_path}")
+
+# 이 세션의 이전 내보내기 파일과 보관 시간이 지난 내보내기 파일 삭제
+def cleanup_exports():
+    previous_path = st.session_state.pop('export_path', None)
+    if previous_path and os.path.exists(previous_path):
+        os.remove(previous_path)
+
+    expire_before = time.time() - EXPORT_TTL.total_seconds()
+    for path in glob.glob(os.path.join(EXPORT_DIR, 'history_*')):
+        try:
+            if os.path.getmtime(path) < expire_before:
+                os.remove(path)
+        except FileNotFoundError:
+            pass  # 다른 세션이 먼저 삭제한 경우
 
 # 일 사용량 페이지
-def daily_usage_page():
+def daily_usage_page(ep_frames):
     st.header("DAILY USAGE")
     
     # 날짜 선택 위젯 (기본값은 오늘)
     selected_date = st.date_input("SELECT DATE", value=datetime.now().date())
     
-    # 현재 날짜를 기준으로 사용량 데이터 생성 (예시 데이터)
-    num_days = (datetime.now().replace(day=1) - timedelta(days=1)).day
-    daily_usage = np.random.randint(100, 300, size=num_days)
+    # 선택한 날짜가 속한 달의 일별 사용량 계산 (EP별 결과를 합산)
+    month_start = pd.Timestamp(selected_date).replace(day=1)
+    month_end = month_start + pd.offsets.MonthBegin(1)
+    usage = query_usage_stats(month_start, month_end, 'D', ep_frames)
+    daily_usage = usage.sum(axis=1)
     
     # 해당 월의 날짜 생성
-    days = [f"{i+1}일" for i in range(num_days)]
+    days = [f"{day.day}일" for day in daily_usage.index]
     
     # 막대 그래프 생성
-    fig = go.Figure([go.Bar(x=days, y=daily_usage)])
+    fig = go.Figure([go.Bar(x=days, y=daily_usage.values)])
     fig.update_layout(title="일별 사용량(L)")
     st.plotly_chart(fig, use_container_width=True)
     
     # 일 평균 사용량 및 요금 계산 (가정: 요금 500원/L)
-    avg_usage = np.mean(daily_usage)
+    avg_usage = np.mean(daily_usage.values)
     avg_bill = avg_usage * 500
     
     st.subheader(f"DAILY AVERAGE USAGE: {avg_usage:.2f} L")
     st.subheader(f"DAILY AVERAGE FEE: {avg_bill:.2f} WON")
 
-def monthly_usage_page():
+def monthly_usage_page(ep_frames):
     st.header("MONTHLY USAGE")
 
     # 연도 선택 (기본값: 현재 연도)
@@ -452,41 +646,43 @@ def monthly_usage_page():
     # 월 선택 (1월 ~ 12월)
     selected_month = st.selectbox("월 선택", [f"{i}월" for i in range(1, 13)], index=datetime.now().month - 1)
 
-    # 예시 데이터: 선택된 연도와 월에 대한 데이터 생성
-    monthly_usage = np.random.randint(3000, 10000, size=12)
-    months = [f"{i+1}월" for i in range(12)]
+    # 선택된 연도의 월별 사용량 계산
+    usage = query_usage_stats(pd.Timestamp(selected_year, 1, 1), pd.Timestamp(selected_year + 1, 1, 1), 'MS', ep_frames)
+    monthly_usage = usage.sum(axis=1)
+    months = [f"{month.month}월" for month in monthly_usage.index]
 
     # 그래프 생성
-    fig = go.Figure([go.Bar(x=months, y=monthly_usage)])
+    fig = go.Figure([go.Bar(x=months, y=monthly_usage.values)])
     fig.update_layout(title=f"{selected_year}년 {selected_month} 사용량(L)")
     st.plotly_chart(fig, use_container_width=True)
 
     # 월 평균 사용량 및 요금 계산
-    avg_usage = np.mean(monthly_usage)
+    avg_usage = np.mean(monthly_usage.values)
     avg_bill = avg_usage * 500
     st.subheader(f"MONTHLY AVERAGE USAGE: {avg_usage:.2f} L")
     st.subheader(f"MONTHLY AVERAGE FEE: {avg_bill:.2f} WON")
 
 
 # 연 사용량 페이지 (연도만 선택할 수 있게 구현)
-def yearly_usage_page():
+def yearly_usage_page(ep_frames):
     st.header("ANNUAL USAGE")
 
     # 연도 선택 (기본값: 현재 연도)
     current_year = datetime.now().year
     selected_year = st.selectbox("연도 선택", [current_year - i for i in range(10)], index=0)
 
-    # 최근 5년간의 사용량 (예시 데이터)
-    years = [(selected_year - i) for i in range(5)]
-    yearly_usage = np.random.randint(30000, 100000, size=5)
+    # 최근 5년간의 사용량 계산
+    usage = query_usage_stats(pd.Timestamp(selected_year - 4, 1, 1), pd.Timestamp(selected_year + 1, 1, 1), 'YS', ep_frames)
+    yearly_usage = usage.sum(axis=1)
+    years = [year.year for year in yearly_usage.index]
 
     # 그래프 생성
-    fig = go.Figure([go.Bar(x=years, y=yearly_usage)])
+    fig = go.Figure([go.Bar(x=years, y=yearly_usage.values)])
     fig.update_layout(title=f"{selected_year} 사용량(L)")
     st.plotly_chart(fig, use_container_width=True)
 
     # 연 평균 사용량 및 요금 계산
-    avg_usage = np.mean(yearly_usage)
+    avg_usage = np.mean(yearly_usage.values)
     avg_bill = avg_usage * 500
     st.subheader(f"ANNUAL AVERAGE USAGE: {avg_usage:.2f} L")
     st.subheader(f"ANNUAL AVERAGE FEE: {avg_bill:.2f} WON")
@@ -668,8 +864,52 @@ def region_settings_page():
         st.write("아직 저장된 그룹이 없습니다.")
 
 
-# 그룹의 EP 데이터를 합산하는 함수
+# 기록 가져오기 페이지 (CSV/Parquet 파일을 청크 단위로 저장소와 롤업에 반영)
+def history_import_page():
+    st.title("데이터 가져오기")
+    st.write("EP 기록 파일(CSV/Parquet, 컬럼: ep, timestamp, flowRate)을 가져옵니다.")
+
+    uploaded_file = st.file_uploader("파일 업로드", type=['csv', 'parquet'])
+    server_file = st.text_input(f"또는 서버 가져오기 폴더({IMPORT_DIR})의 파일 이름 (대용량 파일)")
+    chunk_rows = st.number_input("청크 크기 (행)", min_value=10_000, value=DEFAULT_CHUNK_ROWS, step=100_000)
+
+    if st.button("가져오기"):
+        if uploaded_file is not None:
+            source, file_name = uploaded_file, uploaded_file.name
+        elif server_file:
+            # 가져오기 폴더 밖의 경로(../, 절대 경로, 심볼릭 링크)는 거부
+            import_root = os.path.realpath(IMPORT_DIR)
+            server_path = os.path.realpath(os.path.join(import_root, server_file))
+            if os.path.commonpath([import_root, server_path]) != import_root or not os.path.isfile(server_path):
+                st.error(f"가져오기 폴더({IMPORT_DIR}) 안의 파일만 가져올 수 있습니다.")
+                return
+            source, file_name = server_path, server_path
+        else:
+            st.error("파일을 업로드하거나 서버 파일 이름을 입력해주세요.")
+            return
+
+        file_format = 'parquet' if file_name.lower().endswith('.parquet') else 'csv'
+        progress_placeholder = st.empty()
+        try:
+            rows, rejected_rows = get_history_store().import_file(
+                source, file_format, chunk_rows=int(chunk_rows),
+                on_progress=lambda n: progress_placeholder.write(f"{n:,}행 처리 중..."),
+                executor=get_compaction_executor()
+            )
+        except (ValueError, OSError) as e:
+            st.error(f"가져오기에 실패했습니다: {e}")
+            return
+        progress_placeholder.empty()
+        st.success(f"{rows:,}행을 가져왔습니다.")
+        if rejected_rows:
+            st.warning(f"EP·시각·유량을 해석할 수 없는 {rejected_rows:,}행은 제외했습니다.")
+
+# 그룹의 EP 데이터를 합산하는 함수 (그룹 구성과 데이터 버전 기준으로 캐시)
 def calculate_group_data(group_eps, ep_data):
+    key = ('group_sum', tuple(group_eps), get_data_version({ep: ep_data[ep] for ep in group_eps}))
+    return get_session_cache().get_or_compute(key, lambda: sum_group_data(group_eps, ep_data))
+
+def sum_group_data(group_eps, ep_data):
     # 그룹 내 모든 EP의 데이터를 합산
     total_data = pd.DataFrame(columns=['timestamp', 'flowRate'])
     for ep in group_eps:
@@ -686,7 +926,7 @@ def settings_page():
     st.title("SETTINGS")
 
     # 사이드바에서 설정 메뉴 선택
-    settings_menu = st.sidebar.radio("설정 메뉴", ["그룹 설정", "수도 요금 설정", "요금 시뮬레이션"])
+    settings_menu = st.sidebar.radio("설정 메뉴", ["그룹 설정", "수도 요금 설정", "요금 시뮬레이션", "데이터 가져오기"])
 
     if settings_menu == "그룹 설정":
         region_settings_page()
@@ -694,34 +934,37 @@ def settings_page():
         water_fee_settings_page()  # 기존 구현된 수도 요금 설정 함수
     elif settings_menu == "요금 시뮬레이션":
         fee_simulation_page()  # 기존 구현된 요금 시뮬레이션 함수
+    elif settings_menu == "데이터 가져오기":
+        history_import_page()
 
 # 페이지 전환을 위한 함수 정의 (콜백 함수로 사용)
 def set_page(page_name):
     st.session_state.page = page_name
 
 # 사이드바 메뉴
-with st.sidebar:
-    st.markdown("""
-        <style>
-        [data-testid="collapsedControl"] {
-            display: none;
-        }
-        [data-testid="stSidebar"] {
-            min-width: 200px;
-            max-width: 200px;  /* 사이드바 너비 조정 */
-        }
-        .stButton button {
-            width: 100%;  /* 버튼 너비 고정 */
-            height: 50px; /* 버튼 높이 고정 */
-            font-size: 18px; /* 버튼 텍스트 크기 */
-        }
-        </style>
-    """, unsafe_allow_html=True)
-
-    st.button('홈', on_click=set_page, args=('home',))
-    st.button('실시간', on_click=set_page, args=('realtime',))
-    st.button('통계', on_click=set_page, args=('statistics',))
-    st.button('설정', on_click=set_page, args=('settings',))
+if IS_APP_SCRIPT:
+    with st.sidebar:
+        st.markdown("""
+            <style>
+            [data-testid="collapsedControl"] {
+                display: none;
+            }
+            [data-testid="stSidebar"] {
+                min-width: 200px;
+                max-width: 200px;  /* 사이드바 너비 조정 */
+            }
+            .stButton button {
+                width: 100%;  /* 버튼 너비 고정 */
+                height: 50px; /* 버튼 높이 고정 */
+                font-size: 18px; /* 버튼 텍스트 크기 */
+            }
+            </style>
+        """, unsafe_allow_html=True)
+
+        st.button('홈', on_click=set_page, args=('home',))
+        st.button('실시간', on_click=set_page, args=('realtime',))
+        st.button('통계', on_click=set_page, args=('statistics',))
+        st.button('설정', on_click=set_page, args=('settings',))
 
 # 메인 페이지 구성
 def main():
@@ -738,5 +981,5 @@ def main():
     elif st.session_state.page == 'settings':
         settings_page()
 
-if __name__ == "__main__":
+if IS_APP_SCRIPT:
     main()
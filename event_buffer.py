@@ -0,0 +1,113 @@
+import bisect
+import itertools
+from datetime import timedelta
+
+import pandas as pd
+
+# 버퍼가 바뀔 때마다 발급하는 전역 버전 번호 (세션 간 공유 캐시 키로 쓰이므로 프로세스 전체에서 유일)
+_versions = itertools.count(1)
+
+# EP 하나의 이벤트 시간(기기 시각) 기준 버퍼
+# - 측정값은 기기 시각 순으로 정렬된 상태를 유지하고, 늦게 도착한 값은 정렬 위치에 삽입
+# - 워터마크(지금까지 본 가장 늦은 기기 시각 - 허용 지연)보다 이전 값과 이미 보존 기간이 지나 제거한 구간의 값은 버림
+#   (제거한 구간에 다시 들어온 값은 재전송인지 확인할 수 없어 롤업에 두 번 더해지므로)
+# - 일별 사용량 롤업은 값이 들어올 때마다 해당 날짜만 갱신 (보존 기간이 지나 버퍼에서 빠져도 유지)
+class EventTimeBuffer:
+    def __init__(self, retention=timedelta(minutes=10), allowed_lateness=timedelta(minutes=1)):
+        self.retention = retention
+        self.allowed_lateness = allowed_lateness
+        self.timestamps = []
+        self.flow_rates = []
+        self.daily_usage = {}
+        self.max_event_time = None
+        self.trimmed_until = None  # 이 시각 이하의 값은 버퍼에서 제거됨
+        self.late_count = 0     # 늦게 도착해 삽입된 값 수
+        self.dropped_count = 0  # 허용 지연을 넘겨 버린 값 수
+        self.version = next(_versions)
+        self._frame = None
+        self._rollup_frame = None
+
+    @property
+    def watermark(self):
+        if self.max_event_time is None:
+            return None
+        return self.max_event_time - self.allowed_lateness
+
+    # 해석할 수 없거나 받아들일 수 없는 측정값을 버린 것으로 기록
+    def reject(self):
+        self.dropped_count += 1
+
+    # 측정값 하나를 반영 (데이터가 바뀌었으면 True, 버렸거나 같은 값의 재전송이면 False)
+    def add(self, timestamp, flow_rate):
+        try:
+            timestamp = pd.Timestamp(timestamp)
+        except (ValueError, TypeError):
+            timestamp = pd.NaT
+        if pd.isna(timestamp):
+            self.reject()
+            return False
+
+        # 버퍼에 있는 값과 같은 값의 재전송은 워터마크를 지났더라도 버린 값으로 세지 않음 (같은 배치를 다시 조회한 경우)
+        idx = bisect.bisect_left(self.timestamps, timestamp)
+        exists = idx < len(self.timestamps) and self.timestamps[idx] == timestamp
+        if exists and self.flow_rates[idx] == flow_rate:
+            return False
+
+        watermark = self.watermark
+        if (watermark is not None and timestamp < watermark) or \
+                (self.trimmed_until is not None and timestamp <= self.trimmed_until):
+            self.reject()
+            return False
+
+        if exists:
+            # 같은 시각에 다른 값이 다시 올라온 경우 - 교체하고 차이만 롤업에 반영
+            delta = flow_rate - self.flow_rates[idx]
+            self.flow_rates[idx] = flow_rate
+        else:
+            if idx < len(self.timestamps):
+                self.late_count += 1
+            self.timestamps.insert(idx, timestamp)
+            self.flow_rates.insert(idx, flow_rate)
+            delta = flow_rate
+
+        day = timestamp.normalize()
+        self.daily_usage[day] = self.daily_usage.get(day, 0) + delta
+
+        if self.max_event_time is None or timestamp > self.max_event_time:
+            self.max_event_time = timestamp
+            self._trim()
+
+        self.version = next(_versions)
+        self._frame = None
+        self._rollup_frame = None
+        return True
+
+    # 보존 기간(가장 늦은 기기 시각 기준)보다 오래된 값을 버퍼에서 제거
+    def _trim(self):
+        cutoff = self.max_event_time - self.retention
+        cut = bisect.bisect_right(self.timestamps, cutoff)
+        if cut:
+            del self.timestamps[:cut]
+            del self.flow_rates[:cut]
+            self.trimmed_until = cutoff
+
+    # 보존 기간 안의 측정값 (timestamp, flowRate)
+    def to_frame(self):
+        if self._frame is None:
+            self._frame = pd.DataFrame({
+                'timestamp': pd.to_datetime(pd.Series(self.timestamps, dtype='object')),
+                'flowRate': pd.Series(self.flow_rates, dtype='float64'),
+            })
+            self._frame.attrs['version'] = self.version
+        return self._frame
+
+    # 일별 사용량 롤업 (timestamp=날짜, flowRate=합계)
+    def rollup_frame(self):
+        if self._rollup_frame is None:
+            days = sorted(self.daily_usage)
+            self._rollup_frame = pd.DataFrame({
+                'timestamp': pd.to_datetime(pd.Series(days, dtype='object')),
+                'flowRate': pd.Series([self.daily_usage[day] for day in days], dtype='float64'),
+            })
+            self._rollup_frame.attrs['version'] = self.version
+        return self._rollup_frame
@@ -0,0 +1,241 @@
+import glob
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from usage_stats import compute_partition_rollups
+
+# EP 기록 저장소
+# 원본 데이터는 EP·월 단위 Parquet 파일로, 일별 사용량 롤업은 별도 Parquet 파일 하나로 보관
+#   <root>/raw/ep=<EP>/<YYYY-MM>/compacted.parquet  (압축된 파티션, 시각 순 정렬·시각 중복 없음)
+#   <root>/raw/ep=<EP>/<YYYY-MM>/part-<기록 시각>-<id>.parquet  (가져오는 중 기록한 조각, 가져오기 끝에 압축됨)
+#   <root>/rollups/daily.parquet  (ep, date, flowRate 합계)
+# 입력 파일은 정렬되어 있지 않아도 되며, 같은 (EP, 시각)을 다시 가져오면 나중 값으로 덮어씀
+
+HISTORY_COLUMNS = ['ep', 'timestamp', 'flowRate']
+
+# 기본 청크 크기 (행) - 가져오기/내보내기 시 메모리 사용량의 상한
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+# 디렉터리 이름으로 쓰이므로 EP 이름은 영문/숫자/_/- 만 허용
+EP_NAME_PATTERN = re.compile(r'[\w-]+')
+
+# 타임존 표기(Z, +09:00, -0500)로 끝나는 시각 문자열
+TZ_SUFFIX_PATTERN = r'(?:Z|[+-]\d{2}:?\d{2})$'
+
+# datetime64[ns]로 나타낼 수 있는 범위 (나노초)
+MAX_EPOCH_NS = 9.2e18
+
+# 파일 형식에 맞게 청크 단위로 읽는 함수 (source는 경로 또는 파일 객체)
+def read_chunks(source, file_format, chunk_rows=DEFAULT_CHUNK_ROWS):
+    if file_format == 'csv':
+        yield from pd.read_csv(source, usecols=HISTORY_COLUMNS, chunksize=chunk_rows)
+    elif file_format == 'parquet':
+        parquet_file = pq.ParquetFile(source)
+        missing_columns = [column for column in HISTORY_COLUMNS if column not in parquet_file.schema_arrow.names]
+        if missing_columns:
+            raise ValueError(f"필수 컬럼이 없습니다: {', '.join(missing_columns)}")
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=HISTORY_COLUMNS):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"지원하지 않는 파일 형식입니다: {file_format}")
+
+# 타임존이 있는 시각을 서버 현지 시각(타임존 없음)으로 변환
+def to_local_naive(timestamps):
+    return timestamps.dt.tz_convert(datetime.now().astimezone().tzinfo).dt.tz_localize(None)
+
+# 시각 문자열을 변환 (ISO 8601로 먼저 변환하고, 실패한 값만 형식을 값마다 추론해 다시 변환)
+def parse_time_strings(values, utc):
+    parsed = pd.to_datetime(values, format='ISO8601', errors='coerce', utc=utc)
+    failed = parsed.isna()
+    if failed.any():
+        try:
+            parsed[failed] = pd.to_datetime(values[failed], format='mixed', errors='coerce', utc=utc)
+        except ValueError:
+            pass  # 타임존 이름이 섞인 값 등은 해석하지 않음 (NaT로 남김)
+    return to_local_naive(parsed) if utc else parsed
+
+# 기기 시각 컬럼을 서버 현지 시각으로 변환 (실시간 수집의 parse_device_time과 같은 규칙, 해석할 수 없으면 NaT)
+# - 숫자(epoch 값)는 1e11 이상이면 밀리초, 아니면 초 단위 UTC로 보고 변환
+# - 타임존이 있는 문자열은 서버 현지 시각으로 변환하고, 타임존이 없는 문자열은 그대로 사용
+def parse_timestamps(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return (to_local_naive(values) if values.dt.tz is not None else values).astype('datetime64[ns]')
+
+    timestamps = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+
+    numbers = pd.to_numeric(values, errors='coerce')
+    is_ms = numbers.abs() >= 1e11
+    for unit, epochs, scale in (('ms', numbers[is_ms], 1e6), ('s', numbers[~is_ms & numbers.notna()], 1e9)):
+        epochs = epochs[epochs.abs() * scale < MAX_EPOCH_NS]
+        if not epochs.empty:
+            timestamps[epochs.index] = to_local_naive(pd.to_datetime(epochs, unit=unit, utc=True))
+
+    strings = values[numbers.isna() & values.notna()].astype(str).str.strip()
+    aware = strings.str.contains(TZ_SUFFIX_PATTERN, regex=True)
+    for part, utc in ((strings[~aware], False), (strings[aware], True)):
+        if not part.empty:
+            timestamps[part.index] = parse_time_strings(part, utc).astype('datetime64[ns]')
+    return timestamps
+
+# 컬럼 타입을 맞추고 잘못된 행(EP·시각·유량이 없거나 해석할 수 없는 행)을 제거하는 함수
+# (정리한 청크, 제거한 행 수)를 반환
+def normalize_chunk(chunk):
+    total_rows = len(chunk)
+    chunk = chunk.dropna(subset=['ep'])  # 문자열로 바꾸기 전에 제거 ('nan' EP 방지)
+    chunk = pd.DataFrame({
+        'ep': chunk['ep'].astype(str),
+        'timestamp': parse_timestamps(chunk['timestamp']),
+        'flowRate': pd.to_numeric(chunk['flowRate'], errors='coerce').astype('float64'),
+    })
+    chunk = chunk[chunk['timestamp'].notna() & np.isfinite(chunk['flowRate'])]
+
+    invalid_eps = [ep for ep in chunk['ep'].unique() if not EP_NAME_PATTERN.fullmatch(ep)]
+    if invalid_eps:
+        raise ValueError(f"잘못된 EP 이름입니다: {', '.join(invalid_eps[:5])}")
+    return chunk, total_rows - len(chunk)
+
+class HistoryStore:
+    def __init__(self, root):
+        self.root = root
+        self.raw_dir = os.path.join(root, 'raw')
+        self.rollup_path = os.path.join(root, 'rollups', 'daily.parquet')
+        self._lock = threading.Lock()  # 가져오기는 한 번에 하나씩
+
+    # 저장소 버전 (롤업 파일 수정 시각) - 가져오기가 끝나면 바뀜
+    @property
+    def version(self):
+        try:
+            return os.stat(self.rollup_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    # CSV/Parquet 파일을 청크 단위로 가져와 원본 파티션에 기록한 뒤, 바뀐 EP·월 파티션의 일별 롤업을 다시 계산
+    # 메모리에는 청크 하나만 유지하고, 롤업 계산은 executor(프로세스 풀)에서 파티션 단위로 병렬 실행
+    # (가져온 행 수, 해석할 수 없어 버린 행 수)를 반환
+    def import_file(self, source, file_format, chunk_rows=DEFAULT_CHUNK_ROWS, on_progress=None, executor=None):
+        total_rows = 0
+        rejected_rows = 0
+        touched_partitions = set()
+
+        with self._lock:
+            try:
+                for chunk in read_chunks(source, file_format, chunk_rows):
+                    chunk, rejected = normalize_chunk(chunk)
+                    rejected_rows += rejected
+                    if chunk.empty:
+                        continue
+
+                    touched_partitions.update(self._write_partitions(chunk))
+
+                    total_rows += len(chunk)
+                    if on_progress:
+                        on_progress(total_rows)
+            finally:
+                # 중간에 실패해도 이미 기록한 파티션은 롤업에 반영
+                if touched_partitions:
+                    self._rebuild_rollup(sorted(touched_partitions), executor)
+
+        return total_rows, rejected_rows
+
+    # 청크를 EP·월 단위 파티션 파일로 기록하고, 기록한 (EP, 파티션 경로) 목록을 반환
+    def _write_partitions(self, chunk):
+        partitions = []
+        months = chunk['timestamp'].dt.to_period('M').rename('month')
+        for (ep, month), part in chunk.groupby(['ep', months], sort=False):
+            part_dir = os.path.join(self.raw_dir, f'ep={ep}', str(month))
+            os.makedirs(part_dir, exist_ok=True)
+            part.sort_values('timestamp').to_parquet(
+                os.path.join(part_dir, f'part-{time.time_ns():020d}-{uuid.uuid4().hex}.parquet'), index=False
+            )
+            partitions.append((ep, part_dir))
+        return partitions
+
+    # 주어진 파티션을 압축하고 일별 합계를 다시 계산해 롤업의 해당 EP·월 행을 교체 (임시 파일에 쓴 뒤 교체)
+    def _rebuild_rollup(self, partitions, executor):
+        rollup = compute_partition_rollups(partitions, executor)
+        if os.path.exists(self.rollup_path):
+            existing = pd.read_parquet(self.rollup_path)
+            rebuilt = {(ep, os.path.basename(part_dir)) for ep, part_dir in partitions}
+            existing_keys = zip(existing['ep'], existing['date'].dt.to_period('M').astype(str))
+            keep = [key not in rebuilt for key in existing_keys]
+            rollup = pd.concat([existing[keep], rollup], ignore_index=True)
+
+        os.makedirs(os.path.dirname(self.rollup_path), exist_ok=True)
+        tmp_path = f'{self.rollup_path}.tmp'
+        rollup.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.rollup_path)
+
+    # 롤업에서 EP별·기간별 사용량 표를 계산 (index=기간 시작 시각, columns=EP)
+    def rollup_usage(self, eps, start, end, freq):
+        periods = pd.date_range(start, end, freq=freq, inclusive='left')
+        usage = pd.DataFrame(0.0, index=periods, columns=list(eps))
+        if not os.path.exists(self.rollup_path):
+            return usage
+
+        rollup = pd.read_parquet(self.rollup_path)
+        rollup = rollup[rollup['ep'].isin(eps) & (rollup['date'] >= start) & (rollup['date'] < end)]
+        if rollup.empty:
+            return usage
+
+        table = rollup.pivot_table(index='date', columns='ep', values='flowRate', aggfunc='sum').resample(freq).sum()
+        return usage + table.reindex(index=periods, columns=usage.columns, fill_value=0)
+
+    # [start, end) 구간의 원본 데이터를 EP·월 단위로 정렬해 순서대로 반환 (가져오기 중에는 호출하지 않음)
+    def iter_range(self, eps, start, end):
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        for ep in eps:
+            for month in pd.period_range(start, end, freq='M'):
+                paths = sorted(glob.glob(os.path.join(self.raw_dir, f'ep={ep}', str(month), '*.parquet')))
+                if not paths:
+                    continue
+                part = pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+                part = part[(part['timestamp'] >= start) & (part['timestamp'] < end)]
+                if not part.empty:
+                    part = part.sort_values('timestamp', kind='stable').drop_duplicates('timestamp', keep='last')
+                    yield part[HISTORY_COLUMNS]
+
+    # [start, end) 구간의 원본 데이터를 파일로 내보내기 (EP·월 단위로 이어 써서 전체를 메모리에 올리지 않음)
+    # 가져오기(파티션 압축)와 겹치지 않도록 저장소 잠금을 잡고 실행
+    def export_range(self, eps, start, end, dest, file_format):
+        with self._lock:
+            return self._export_range(eps, start, end, dest, file_format)
+
+    def _export_range(self, eps, start, end, dest, file_format):
+        total_rows = 0
+
+        if file_format == 'csv':
+            with open(dest, 'w', newline='', encoding='utf-8') as f:
+                header = True
+                for part in self.iter_range(eps, start, end):
+                    part.to_csv(f, header=header, index=False)
+                    header = False
+                    total_rows += len(part)
+                if header:
+                    pd.DataFrame(columns=HISTORY_COLUMNS).to_csv(f, index=False)
+        elif file_format == 'parquet':
+            writer = None
+            try:
+                for part in self.iter_range(eps, start, end):
+                    table = pa.Table.from_pandas(part, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(dest, table.schema)
+                    writer.write_table(table)
+                    total_rows += len(part)
+            finally:
+                if writer is not None:
+                    writer.close()
+            if writer is None:
+                pd.DataFrame(columns=HISTORY_COLUMNS).to_parquet(dest, index=False)
+        else:
+            raise ValueError(f"지원하지 않는 파일 형식입니다: {file_format}")
+
+        return total_rows
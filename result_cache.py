@@ -0,0 +1,79 @@
+import sys
+import threading
+from collections import OrderedDict
+
+# 캐시 항목의 대략적인 메모리 크기 (바이트)
+# pandas 객체는 memory_usage로, 그 외에는 sys.getsizeof로 추정
+def estimate_size(value):
+    if hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    return sys.getsizeof(value)
+
+# 파생 결과(그룹 합산, 통계, 요금 계산용 사용량, 그래프)를 보관하는 LRU 캐시
+# 키는 (결과 종류, 조회 조건, 데이터 버전)으로 구성하므로 DataFrame을 해싱하지 않고,
+# 새 데이터가 들어오면 버전이 바뀌어 해당 결과만 다시 계산됨 (이전 버전 항목은 LRU로 밀려남)
+# 항목 수(max_entries)와 대략적인 전체 크기(max_bytes) 중 지정한 한도를 넘으면 오래된 항목부터 제거
+# 여러 세션이 같은 객체를 공유할 수 있으므로 캐시된 결과는 수정하지 않고 읽기 전용으로 사용해야 함
+class ResultCache:
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()  # 세션별 스크립트 스레드에서 동시에 접근
+
+    # 캐시에 있으면 반환하고, 없으면 compute()로 계산해 저장
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        # 계산은 락 밖에서 수행 (긴 계산이 다른 세션의 캐시 조회를 막지 않도록)
+        value = compute()
+        size = estimate_size(value) if self.max_bytes is not None else 0
+
+        # 한도보다 큰 결과는 저장하지 않음 (다른 항목을 모두 밀어내지 않도록)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while self._entries and self._over_limit():
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def _over_limit(self):
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.total_bytes > self.max_bytes
+
+    # 캐시 비우기 (통계 값은 유지)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    # 적중/미스 통계
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,66 @@
+import glob
+import os
+
+import pandas as pd
+
+# 통계 계산 함수 모음
+# 프로세스 풀 워커에서 실행되므로 Streamlit에 의존하지 않는 별도 모듈로 분리
+# (Streamlit 스크립트 안에서 정의한 함수는 워커 프로세스로 피클링되지 않음)
+
+# 타임스탬프 순으로 정렬된 EP 데이터에서 [start, end) 구간만 잘라내는 함수
+def slice_time_range(data, start, end):
+    timestamps = data['timestamp']
+    lo = timestamps.searchsorted(pd.Timestamp(start), side='left')
+    hi = timestamps.searchsorted(pd.Timestamp(end), side='left')
+    return data.iloc[lo:hi]
+
+# EP별·기간별 사용량 표를 계산하는 함수 (index=기간 시작 시각, columns=EP)
+# 입력은 EP별 일별 롤업처럼 작은 데이터이므로 바로 계산
+def compute_usage_stats(ep_frames, start, end, freq):
+    periods = pd.date_range(start, end, freq=freq, inclusive='left')
+    usage = pd.DataFrame(0.0, index=periods, columns=list(ep_frames))
+    for ep, data in ep_frames.items():
+        part = slice_time_range(data, start, end)
+        if not part.empty:
+            usage[ep] += part.set_index('timestamp')['flowRate'].resample(freq).sum().reindex(periods, fill_value=0)
+    return usage
+
+# EP·월 파티션 하나를 압축하고 일별 사용량을 계산하는 함수 (워커에서 실행)
+# 기존 압축 파일과 새 조각 파일을 합쳐 시각 순으로 정렬하고, 같은 시각은 나중에 가져온 값만 남겨 파일 하나로 저장
+# (조각 파일 이름은 기록 시각 순으로 정렬되므로 같은 파일을 다시 가져와도 값이 두 번 더해지지 않음)
+def compact_partition(ep, part_dir):
+    compacted_path = os.path.join(part_dir, 'compacted.parquet')
+    part_paths = sorted(glob.glob(os.path.join(part_dir, 'part-*.parquet')))
+    paths = ([compacted_path] if os.path.exists(compacted_path) else []) + part_paths
+    if not paths:
+        return ep, pd.Series(dtype='float64')
+
+    data = pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+    data = data.sort_values('timestamp', kind='stable').drop_duplicates('timestamp', keep='last')
+
+    if part_paths:
+        tmp_path = f'{compacted_path}.tmp'
+        data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, compacted_path)
+        for path in part_paths:
+            os.remove(path)
+
+    return ep, data.set_index('timestamp')['flowRate'].resample('D').sum()
+
+# 여러 EP·월 파티션을 압축하고 일별 사용량을 계산해 (ep, date, flowRate) 표로 합치는 함수
+# 원본 데이터가 큰 작업이므로 파티션 단위로 프로세스 풀에 나눠 실행
+def compute_partition_rollups(partitions, executor=None):
+    if executor is None or len(partitions) < 2:
+        results = [compact_partition(ep, part_dir) for ep, part_dir in partitions]
+    else:
+        futures = [executor.submit(compact_partition, ep, part_dir) for ep, part_dir in partitions]
+        results = [future.result() for future in futures]
+
+    frames = [
+        pd.DataFrame({'ep': ep, 'date': daily.index, 'flowRate': daily.values})
+        for ep, daily in results if not daily.empty
+    ]
+    if not frames:
+        return pd.DataFrame({'ep': pd.Series(dtype='object'), 'date': pd.Series(dtype='datetime64[ns]'),
+                             'flowRate': pd.Series(dtype='float64')})
+    return pd.concat(frames, ignore_index=True)